@@ -0,0 +1,433 @@
+import sys
+from io import BytesIO
+
+from PyPDF2 import PdfFileReader, PdfFileWriter, PageObject
+from PyPDF2.errors import PdfReadError
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, \
+    NumberObject
+
+# pikepdf is imported when first needed (see _import_pikepdf()), so importing the package does not pay for it
+pikepdf = None
+
+# Font used for stamps (one of the standard fonts, which PDF-readers provide)
+_STAMP_FONT_NAME = "/StampHelv"
+_STAMP_FONT = {"/Type": "/Font", "/Subtype": "/Type1", "/BaseFont": "/Helvetica", "/Encoding": "/WinAnsiEncoding"}
+
+# Font-dictionary shared by all stamped PyPDF2-pages (never modified, so it is not made per page)
+_PYPDF2_STAMP_FONT = DictionaryObject({NameObject(key): NameObject(value) for key, value in _STAMP_FONT.items()})
+
+
+def make_backend(name):
+    """
+    Make backend for holding pages and writing the file of a container.
+    :param str name: Name of backend.
+        PyPDF2 : Pure python.
+        pikepdf: Uses qpdf (requires pikepdf).
+        auto   : pikepdf if it is installed, otherwise PyPDF2.
+    :return: PyPDF2Backend | PikepdfBackend
+    """
+    if name == "auto":
+        name = "pikepdf" if _import_pikepdf() else "PyPDF2"
+    if name == "PyPDF2":
+        return PyPDF2Backend()
+    if name == "pikepdf":
+        if not _import_pikepdf():
+            raise ImportError("The pikepdf-backend requires pikepdf to be installed.")
+        return PikepdfBackend()
+    raise ValueError(f"Unknown backend '{name}'. Use 'PyPDF2', 'pikepdf' or 'auto'.")
+
+
+def page_backend(pdf_page):
+    """
+    Backend-class for working with a page.
+    :param PageObject | pikepdf.Page pdf_page: Page.
+    :return: type
+    """
+    # Pages can only be pikepdf-pages if pikepdf has been imported (by anyone)
+    module = sys.modules.get("pikepdf")
+    if module is not None and isinstance(pdf_page, module.Page):
+        _import_pikepdf()
+        return PikepdfBackend
+    return PyPDF2Backend
+
+
+def _import_pikepdf():
+    """
+    Import pikepdf, if it is installed.
+    :return: bool
+    """
+    global pikepdf
+    if pikepdf is None:
+        try:
+            import pikepdf as module
+        except ImportError:
+            return False
+        pikepdf = module
+    return True
+
+
+class PyPDF2Backend:
+    # Errors when reading an existing PDF-file
+    read_errors = (OSError, PdfReadError)
+
+    def __init__(self):
+        """
+        Holds pages and writes them to file using PyPDF2 (pure python).
+        """
+        self.writer = None
+        self._has_replaced_pages = False  # Replaced pages are still held by writer
+        self.reset()
+
+    def __len__(self):
+        return self.writer.getNumPages()
+
+    def reset(self):
+        """
+        Remove all pages.
+        """
+        self.writer = PdfFileWriter()
+        self._has_replaced_pages = False
+
+    def load(self, file_path):
+        """
+        Load pages of existing PDF-file.
+        :param Path file_path: Path to PDF-file.
+        """
+        reader = PdfFileReader(str(file_path))
+        for page in reader.pages:
+            self.writer.addPage(page)
+
+    @staticmethod
+    def page_from_pdf(pdf_bytes):
+        """
+        Make page from single-page PDF (detached, so reader and buffer are released).
+        :param bytes pdf_bytes: PDF-file.
+        :return: PageObject
+        """
+        return detach_pdf_page(PdfFileReader(BytesIO(pdf_bytes)).getPage(0))
+
+    def convert_page(self, page):
+        """
+        Make page usable with backend.
+        :param PageObject page: Page.
+        :return: PageObject
+        """
+        return page
+
+    def release_pages(self):
+        """
+        Release what is kept for pages which have now been added to the writer.
+        """
+
+    def append_pages(self, pages):
+        """
+        Append pages to the end of the writer.
+        Pages are spliced into the page-tree together, updating the page-count once.
+        :param list[PageObject] pages: Pages for file.
+        """
+        # Get the page-tree of the writer
+        try:
+            page_tree = self.writer._pages.getObject()
+            kids = page_tree["/Kids"]
+        except (AttributeError, KeyError):
+            # Fall back to adding pages one by one (for PyPDF2-versions with other internals)
+            for page in pages:
+                self.writer.addPage(page)
+            return
+
+        # Register pages and splice them into page-tree
+        for page in pages:
+            page[NameObject("/Parent")] = self.writer._pages
+        kids.extend([self.writer._add_object(page) for page in pages])
+        page_tree[NameObject("/Count")] = NumberObject(len(kids))
+
+        # Use highest PDF-version of pages (as done by PyPDF2 when adding single pages)
+        headers = [getattr(page.pdf, "pdf_header", None) for page in pages]
+        headers = [header.encode() if isinstance(header, str) else header for header in headers if header]
+        if headers and hasattr(self.writer, "pdf_header"):
+            self.writer.pdf_header = max([self.writer.pdf_header] + headers)
+
+    def replace_pages(self, pages):
+        """
+        Replace pages of the writer.
+        Pages are swapped directly into the page-tree of the writer, so other pages are not copied.
+        :param dict[int, PageObject] pages: Pages mapped by page-numbers (all within the writer).
+        """
+        # Get the page-tree of the writer
+        try:
+            kids = self.writer._pages.getObject()["/Kids"]
+        except (AttributeError, KeyError):
+            # Fall back to rewriting all pages (for PyPDF2-versions with other internals)
+            self._rewrite_pages(pages)
+            return
+
+        for num, page in pages.items():
+            page[NameObject("/Parent")] = self.writer._pages
+            kids[num] = self.writer._add_object(page)
+            self._has_replaced_pages = True
+
+    def _rewrite_pages(self, pages):
+        """
+        Replace pages by writing all pages to a new writer.
+        :param dict[int, PageObject] pages: Pages mapped by page-numbers.
+        """
+        # Write past-data from writer to reader
+        reader = BytesIO()
+        self.writer.write(reader)
+        reader = PdfFileReader(reader)
+
+        # Make new writer and transfer pages
+        self.writer = PdfFileWriter()
+        for i in range(reader.getNumPages()):
+            self.writer.addPage(pages[i] if i in pages else reader.getPage(i))
+
+    def write(self, stream):
+        """
+        Write PDF-file with pages.
+        :param stream: Stream to write to.
+        """
+        if self._has_replaced_pages:
+            self._compact_writer()
+        self.writer.write(stream)
+
+    def _compact_writer(self):
+        """
+        Move the current pages of the writer to a new writer.
+        PyPDF2 writes all objects it has been given, so replaced pages (and their content) would otherwise stay in the
+        file. The new writer only gets the objects which are used by the current pages.
+        """
+        pages = [kid.getObject() for kid in self.writer._pages.getObject()["/Kids"]]
+        self.reset()
+        self.append_pages(pages)
+
+    @staticmethod
+    def page_size(pdf_page):
+        """
+        Width and height of a page (from its media-box).
+        :param PageObject pdf_page: Page.
+        :return: tuple[int, int]
+        """
+        media_box = pdf_page.mediaBox
+        return int(media_box[2]), int(media_box[3])
+
+    @staticmethod
+    def add_text(pdf_page, make_content):
+        """
+        Put text on top of a page, by appending a content-stream with the text-operators to the page.
+        The content already on the page is kept as it is (not decoded, parsed and re-encoded), but is put in its own
+        graphics state, so it does not affect the text.
+        :param PageObject pdf_page: Page to put text on.
+        :param make_content: Function making the content from the name of the stamp-font in the page-resources.
+        """
+        content = make_content(font_name=_add_stamp_font(pdf_page))
+
+        streams = ArrayObject()
+        contents = pdf_page.get("/Contents")
+        if contents is not None:
+            contents_object = contents.getObject()
+            streams.append(_content_stream(b"q\n"))
+            streams.extend(contents_object if isinstance(contents_object, ArrayObject) else [contents])
+            streams.append(_content_stream(b"Q\n"))
+        streams.append(_content_stream(content))
+        pdf_page[NameObject("/Contents")] = streams
+
+
+class PikepdfBackend:
+    def __init__(self):
+        """
+        Holds pages and writes them to file using pikepdf (qpdf), which is faster and writes smaller files.
+        Made by make_backend(), which imports pikepdf.
+        """
+        # Errors when reading an existing PDF-file
+        self.read_errors = (OSError, PdfReadError, pikepdf.PdfError)
+
+        self.writer = None
+        self._page_sources = []  # PDFs of pages not yet added to the writer
+        self.reset()
+
+    def __len__(self):
+        return len(self.writer.pages)
+
+    def reset(self):
+        """
+        Remove all pages.
+        """
+        self.writer = pikepdf.Pdf.new()
+
+    def load(self, file_path):
+        """
+        Load pages of existing PDF-file.
+        :param Path file_path: Path to PDF-file.
+        """
+        self.writer = pikepdf.open(BytesIO(file_path.read_bytes()))
+
+    def page_from_pdf(self, pdf_bytes):
+        """
+        Make page from single-page PDF.
+        :param bytes pdf_bytes: PDF-file.
+        :return: pikepdf.Page
+        """
+        return self._source_page(pikepdf.open(BytesIO(pdf_bytes)))
+
+    def convert_page(self, page):
+        """
+        Make page usable with backend (PyPDF2-pages are converted).
+        :param PageObject | pikepdf.Page page: Page.
+        :return: pikepdf.Page
+        """
+        if isinstance(page, PageObject):
+            page = self._source_page(pypdf2_page_to_pikepdf(page))
+        return page
+
+    def _source_page(self, source):
+        """
+        Get page of a single-page PDF, keeping the PDF until the page has been added to the writer.
+        :param pikepdf.Pdf source: PDF with page.
+        :return: pikepdf.Page
+        """
+        self._page_sources.append(source)
+        return source.pages[0]
+
+    def release_pages(self):
+        """
+        Release the PDFs of pages which have now been added to the writer.
+        """
+        self._page_sources = []
+
+    def append_pages(self, pages):
+        """
+        Append pages to the end of the writer.
+        :param list[pikepdf.Page] pages: Pages for file.
+        """
+        self.writer.pages.extend(pages)
+
+    def replace_pages(self, pages):
+        """
+        Replace pages of the writer.
+        :param dict[int, pikepdf.Page] pages: Pages mapped by page-numbers (all within the writer).
+        """
+        for num, page in pages.items():
+            self.writer.pages[num] = page
+
+    def write(self, stream):
+        """
+        Write PDF-file with pages (objects no longer used by pages are left out by qpdf).
+        :param stream: Stream to write to.
+        """
+        self.writer.save(stream, linearize=False, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+
+    @staticmethod
+    def page_size(pdf_page):
+        """
+        Width and height of a page (from its media-box).
+        :param pikepdf.Page pdf_page: Page.
+        :return: tuple[int, int]
+        """
+        media_box = pdf_page.mediabox
+        return int(media_box[2]), int(media_box[3])
+
+    @staticmethod
+    def add_text(pdf_page, make_content):
+        """
+        Put text on top of a page, by adding a content-stream with the text-operators to the page.
+        The content already on the page is kept as it is, but is put in its own graphics state.
+        :param pikepdf.Page pdf_page: Page to put text on.
+        :param make_content: Function making the content from the name of the stamp-font in the page-resources.
+        """
+        font = pikepdf.Dictionary({key: pikepdf.Name(value) for key, value in _STAMP_FONT.items()})
+        font_name = pdf_page.add_resource(font, pikepdf.Name.Font, prefix=_STAMP_FONT_NAME[1:])
+        content = make_content(font_name=str(font_name))
+        pdf_page.contents_add(b"q\n", prepend=True)
+        pdf_page.contents_add(b"Q\n" + content)
+
+
+def _add_stamp_font(pdf_page):
+    """
+    Add the stamp-font to the font-resources of a PyPDF2-page (if not already there) and return its name.
+    :param PageObject pdf_page: Page for font.
+    :return: str
+    """
+    if "/Resources" not in pdf_page:
+        pdf_page[NameObject("/Resources")] = DictionaryObject()
+    resources = pdf_page["/Resources"].getObject()
+    if "/Font" not in resources:
+        resources[NameObject("/Font")] = DictionaryObject()
+    fonts = resources["/Font"].getObject()
+
+    # Use a name not used by other fonts of the page
+    name, nr = _STAMP_FONT_NAME, 0
+    while name in fonts and fonts[name].getObject() != _PYPDF2_STAMP_FONT:
+        nr += 1
+        name = f"{_STAMP_FONT_NAME}{nr}"
+    fonts[NameObject(name)] = _PYPDF2_STAMP_FONT
+
+    return name
+
+
+def _content_stream(data):
+    stream = DecodedStreamObject()
+    stream.setData(data)
+    return stream
+
+
+class _DetachedObjects:
+    def __init__(self, pdf_header):
+        """
+        Stand-in for a reader, holding only the objects of a detached page.
+        :param bytes pdf_header: Header of the PDF-file the page was read from.
+        """
+        self.pdf_header = pdf_header
+        self.objects = {}
+
+    def get_object(self, indirect_reference):
+        return self.objects[indirect_reference.idnum, indirect_reference.generation]
+
+    getObject = get_object
+
+
+def detach_pdf_page(pdf_page):
+    """
+    Move the objects of a page read from a PDF-file out of the reader, so the page no longer depends on the reader.
+    This lets the reader (and the buffer it reads from) be released while the page is kept.
+    Indirect references are kept (now pointing to the detached objects), so writers can still share objects.
+    :param PageObject pdf_page: Page from a reader.
+    :return: PageObject
+    """
+    detached = _DetachedObjects(pdf_header=getattr(pdf_page.pdf, "pdf_header", None))
+
+    def _detach(obj):
+        items = list(obj.items()) if isinstance(obj, DictionaryObject) else list(enumerate(obj))
+        for key, value in items:
+            if isinstance(value, IndirectObject):
+                reference = value.idnum, value.generation
+                obj[key] = IndirectObject(value.idnum, value.generation, detached)
+                if reference in detached.objects:
+                    continue
+                value = detached.objects[reference] = value.getObject()
+            if isinstance(value, (DictionaryObject, ArrayObject)):
+                _detach(value)
+
+    # The page is placed in a new page-tree when added to a writer
+    if "/Parent" in pdf_page:
+        del pdf_page["/Parent"]
+
+    _detach(pdf_page)
+    pdf_page.pdf = detached
+    pdf_page.indirect_reference = None
+
+    return pdf_page
+
+
+def pypdf2_page_to_pikepdf(pdf_page):
+    """
+    Convert a PyPDF2-page to a single-page pikepdf-PDF.
+    The PDF must be kept (not garbage collected) for as long as its page is used.
+    :param PageObject pdf_page: PyPDF2-page.
+    :return: pikepdf.Pdf
+    """
+    writer = PdfFileWriter()
+    writer.addPage(pdf_page)
+    buf = BytesIO()
+    writer.write(buf)
+    buf.seek(0)
+    return pikepdf.open(buf)
@@ -14,22 +14,22 @@ container = PDFFigureContainer(Path(output_dir, "container.pdf"))
 container.set_timestamp(font_size=9)  # Put timestamp in corner
 container.set_enumeration(n_pages=3, font_size=9)  # Put page number in corner
 
-# Create some figures and add to container
-
-# Figure 1
-plt.figure()
-plt.scatter([1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 9, 2, 8, 3, 7, 4, 6, 5])
-container.add_figure_page()
-
-# Figure 2
-plt.figure()
-plt.plot([1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1], [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11])
-container.add_figure_page()
-
-# Figure 2 3
-plt.figure()
-plt.scatter([1, 1, 1, 2, 3, 3, 3, 4, 5], [1, 2, 3, 3, 3, 2, 1, 1, 1])
-container.add_figure_page()
+# Create some figures and add to container (committed to file together at the end of the with-block)
+with container:
+    # Figure 1
+    plt.figure()
+    plt.scatter([1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 9, 2, 8, 3, 7, 4, 6, 5])
+    container.add_figure_page()
+
+    # Figure 2
+    plt.figure()
+    plt.plot([1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1], [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11])
+    container.add_figure_page()
+
+    # Figure 2 3
+    plt.figure()
+    plt.scatter([1, 1, 1, 2, 3, 3, 3, 4, 5], [1, 2, 3, 3, 3, 2, 1, 1, 1])
+    container.add_figure_page()
 plt.close("all")
 
 # Print
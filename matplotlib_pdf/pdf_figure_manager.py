@@ -1,29 +1,62 @@
+import os
+import pickle
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from itertools import repeat
 from pathlib import Path
 from time import sleep
+from weakref import WeakKeyDictionary
 
-import matplotlib.pyplot as plt
-from PyPDF2 import PdfFileWriter, PdfFileReader, PageObject
-from PyPDF2.errors import PdfReadError
+from PyPDF2 import PageObject
 
+from ._pdf_backend import make_backend, PyPDF2Backend
 from .stampers import TimeStamper, Enumerator
+from .utility import pdf_page_size
 
 
 class PDFFigureContainer:
     # noinspection PyTypeChecker
-    def __init__(self, file_path, truncate_file=True, mk_dir=True):
+    def __init__(self, file_path, truncate_file=True, mk_dir=True, auto_commit=True, cache_figures=False,
+                 cache_tight_bbox=False, backend="PyPDF2"):
         """
         Can maintain a PDF-file with Matplotlib figures in.
         Can update specific pages while maintaining the rest.
         Can be set to stamp pages with page-numbers and write-times.
         :param Path | str file_path: Path to put PDF-file with figures.
+            The file is written to a temporary file in the same directory, which then replaces the file. This requires
+            write-access to the directory, and a symbolic link at the path is replaced by a regular file.
         :param bool truncate_file: Empty file at start. Otherwise keep pages.
         :param bool mk_dir: Make directory and parents if they don't exist.
+        :param bool auto_commit: Commit pages to file when added (unless otherwise specified when adding).
+            If False then pages are held in buffer until commit() is called.
+        :param bool cache_figures: Keep the saved PDF of each figure and reuse it when the same figure is added again
+            without having been changed. Not used in interactive mode, and figures should not be redrawn outside of
+            the container while caching.
+        :param bool cache_tight_bbox: Compute the tight bounding-box (bbox_inches="tight") once for each figure-size and
+            reuse it for following figures of the same size, instead of computing it for every figure.
+            Only use if the figures have the same layout (ex. same labels with new data).
+        :param str backend: Library used for holding pages and writing the file.
+            PyPDF2 : Pure python (default).
+            pikepdf: Uses qpdf, which is faster and writes smaller files (requires pikepdf).
+            auto   : pikepdf if it is installed, otherwise PyPDF2.
         """
+        # Backend (holds pages and writes file)
+        self._backend = make_backend(backend)
+
         # Temporary storage
         self._spool_storage = []
 
+        # Saved figures (figure -> (savefig-options, PDF-bytes))
+        self._figure_cache = WeakKeyDictionary() if cache_figures else None
+
+        # Tight bounding-boxes (figure-size and dpi -> Bbox in inches)
+        self._tight_bboxes = {} if cache_tight_bbox else None
+
+        # Committing
+        self._auto_commit = auto_commit
+        self._auto_commit_stack = []
+
         # Time-stamping
         self._time_stamp_pages = False
         self._time_stamper = None  # type: TimeStamper
@@ -37,17 +70,8 @@ class PDFFigureContainer:
         if mk_dir:
             self._file_path.parent.mkdir(parents=True, exist_ok=True)
 
-        # Make writer
-        self._writer = PdfFileWriter()
-        if not truncate_file and file_path.is_file():
-            try:
-                reader = PdfFileReader(str(file_path))
-                for page in reader.pages:
-                    self._writer.addPage(page)
-
-            except (OSError, PdfReadError):
-                print("Unable to read PDF-file! Overwriting.")
-                self._writer = PdfFileWriter()
+        # Pages of existing file are loaded when first needed
+        self._preload_path = self._file_path if not truncate_file and self._file_path.is_file() else None
 
     def __str__(self):
         return f"PDFFigureContainer({self._file_path})"
@@ -58,11 +82,44 @@ class PDFFigureContainer:
     def __len__(self):
         return self._full_length()
 
+    def __enter__(self):
+        """
+        Buffer all added pages until the end of the with-block, where they are committed to file together.
+        """
+        self._auto_commit_stack.append(self._auto_commit)
+        self._auto_commit = False
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._auto_commit = self._auto_commit_stack.pop()
+
+        # Commit buffered pages (on errors they are kept in buffer)
+        if exc_type is None:
+            self.commit()
+
+    @property
+    def _writer(self):
+        return self._backend.writer
+
+    def _load_file(self):
+        """
+        Load pages of existing PDF-file into writer.
+        """
+        file_path, self._preload_path = self._preload_path, None
+        try:
+            self._backend.load(file_path)
+
+        except self._backend.read_errors:
+            print("Unable to read PDF-file! Overwriting.")
+            self._backend.reset()
+
     def _file_length(self):
-        return self._writer.getNumPages()
+        if self._preload_path is not None:
+            self._load_file()
+        return len(self._backend)
 
     def _full_length(self):
-        return self._writer.getNumPages() + len(self._spool_storage)
+        return self._file_length() + len(self._spool_storage)
 
     @property
     def file_path(self):
@@ -182,35 +239,96 @@ class PDFFigureContainer:
         :param figure: Figure to put into PDF (defaults to plt.gcf()).
         :param str bbox_inches: Setting for making page tight. Passed onto pyplot.savefig().
         :param facecolor: Facecolor of page.
-        :param pause: A floating-point for seconds to wait for matplotlib before saving page (otherwise figure may be
-            saved before generated). If this is a problem, then a typical value would be 0.1.
+        :param pause: If not None, then wait for matplotlib to draw the figure before saving page (otherwise figure may
+            be saved before generated). Kept as a number of seconds for compatibility, but only waits for the drawing.
         """
+        pdf_bytes = PDFFigureContainer._figure2pdf(figure=figure, bbox_inches=bbox_inches,
+                                                   facecolor=facecolor, pause=pause)
+        return PDFFigureContainer._pdf2page(pdf_bytes)
+
+    def _cached_figure2pdf(self, figure, bbox_inches="tight", facecolor=None, pause=None):
+        """
+        Save figure as a single-page PDF, but reuse the saved PDF of the figure if it has not changed since it was
+        saved.
+        :return: bytes
+        """
+        options = (bbox_inches, facecolor)
+
+        # Use saved PDF if figure is unchanged (changes to a figure marks it as stale)
+        import matplotlib
+
+        cached = self._figure_cache.get(figure)
+        interactive = matplotlib.is_interactive()
+        if cached is not None and cached[0] == options and not figure.stale and not interactive:
+            pdf_bytes = cached[1]
+
+        else:
+            pdf_bytes = self._figure2pdf(figure=figure, bbox_inches=bbox_inches, facecolor=facecolor, pause=pause)
+            if not interactive:
+                self._figure_cache[figure] = (options, pdf_bytes)
+                figure.stale = False
+
+        return pdf_bytes
+
+    @staticmethod
+    def _figure2pdf(figure=None, bbox_inches="tight", facecolor=None, pause=None):
+        """
+        Save figure as a single-page PDF.
+        :return: bytes
+        """
+        figure = _get_figure(figure)
+
+        # Draw figure and process pending events (returns as soon as matplotlib is done)
         if pause is not None:
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
-                plt.pause(pause)
+                figure.canvas.draw()
+                figure.canvas.flush_events()
 
         # Default options
         options = dict(bbox_inches=bbox_inches)
         if facecolor is not None:
             options["facecolor"] = facecolor
 
-        # Default figure-fetch
-        if figure is None:
-            figure = plt.gcf()
-
         # Save figure to buffer
         buf = BytesIO()
         figure.savefig(buf, format='pdf', **options)
-        buf.seek(0)
 
-        # Make PDF-page
-        new_pdf = PdfFileReader(buf)
-        page = new_pdf.getPage(0)
+        return buf.getvalue()
 
-        return page
+    @staticmethod
+    def _pdf2page(pdf_bytes):
+        """
+        Make page from single-page PDF (detached, so reader and buffer are released).
+        :param bytes pdf_bytes: PDF-file.
+        :return: PageObject
+        """
+        return PyPDF2Backend.page_from_pdf(pdf_bytes)
 
-    def add_figure_page(self, page_nr=None, figure=None, commit=True,
+    def _bbox_inches(self, figure, bbox_inches):
+        """
+        Get bbox_inches for saving figure, using the cached tight bounding-box of the figure-size if enabled.
+        :param figure: Figure to save.
+        :param str bbox_inches: Setting for making page tight.
+        :return: str | Bbox
+        """
+        if self._tight_bboxes is None or bbox_inches != "tight":
+            return bbox_inches
+
+        import matplotlib
+
+        key = (tuple(figure.get_size_inches()), figure.dpi)
+        bbox = self._tight_bboxes.get(key)
+        if bbox is None:
+            # Draw figure first, so the layout-engine has run and text-extents are up to date
+            figure.draw_without_rendering()
+            self._tight_bboxes[key] = figure.get_tightbbox().padded(matplotlib.rcParams["savefig.pad_inches"])
+
+            # The first figure of each size is saved with the tight bounding-box computed by matplotlib
+            return bbox_inches
+        return bbox
+
+    def add_figure_page(self, page_nr=None, figure=None, commit=None,
                         bbox_inches="tight", facecolor=None, pause=None):
         """
         Convert matplotlib figure to page in PDF.
@@ -218,30 +336,118 @@ class PDFFigureContainer:
             None: Append page to file.
             int:  Replace specific page location with page.
         :param figure: Figure to put into PDF (defaults to plt.gcf()).
-        :param bool commit: Commit page to PDF. If False then page is held in buffer until commit() is called.
+        :param bool | None commit: Commit page to PDF. If False then page is held in buffer until commit() is called.
+            None: Use the setting of the container (auto_commit, or buffering within a with-block).
         :param str bbox_inches: Setting for making page tight. Passed onto pyplot.savefig().
         :param facecolor: Facecolor of page.
-        :param pause: A floating-point for seconds to wait for matplotlib before saving page (otherwise figure may be
-            saved before generated). If this is a problem, then a typical value would be 0.1.
+        :param pause: If not None, then wait for matplotlib to draw the figure before saving page (otherwise figure may
+            be saved before generated). Kept as a number of seconds for compatibility, but only waits for the drawing.
         """
+        figure = _get_figure(figure)
+        bbox_inches = self._bbox_inches(figure=figure, bbox_inches=bbox_inches)
+
         # Convert figure to page
-        page = self.figure2page(figure=figure, bbox_inches=bbox_inches, facecolor=facecolor, pause=pause)
+        if self._figure_cache is None:
+            pdf_bytes = self._figure2pdf(figure=figure, bbox_inches=bbox_inches, facecolor=facecolor, pause=pause)
+        else:
+            pdf_bytes = self._cached_figure2pdf(figure=figure, bbox_inches=bbox_inches, facecolor=facecolor,
+                                                pause=pause)
+        page = self._backend.page_from_pdf(pdf_bytes)
 
         # Add page
         return self.add_page(page=page, page_nr=page_nr, commit=commit)
 
-    def add_page(self, page, page_nr=None, commit=True):
+    def add_figure_pages(self, figures, page_nrs=None, commit=None,
+                         bbox_inches="tight", facecolor=None, max_workers=None):
+        """
+        Convert multiple matplotlib figures to pages in PDF.
+        The figures are rendered in parallel processes, so they must be picklable.
+        Unstamped figures rendered in this process, which make up the whole file, are written directly to the file by
+        matplotlib.
+        :param list figures: Figures to put into PDF.
+        :param list[int | None] page_nrs: Page number of each page (see add_figure_page()).
+            None: Append all pages to file.
+        :param bool | None commit: Commit pages to PDF. If False then pages are held in buffer until commit() is called.
+            None: Use the setting of the container (auto_commit, or buffering within a with-block).
+        :param str bbox_inches: Setting for making page tight. Passed onto pyplot.savefig().
+        :param facecolor: Facecolor of pages.
+        :param int max_workers: Maximum number of processes. Defaults to the number of processors.
+            If 1 (or only one figure is given) the figures are rendered in this process.
+        :return: list[int]
+        """
+        figures = list(figures)
+        if page_nrs is None:
+            page_nrs = [None] * len(figures)
+        elif len(page_nrs) != len(figures):
+            raise ValueError(f"Got {len(page_nrs)} page-numbers for {len(figures)} figures.")
+
+        bboxes = [self._bbox_inches(figure=figure, bbox_inches=bbox_inches) for figure in figures]
+        if commit is None:
+            commit = self._auto_commit
+
+        # Unstamped figures rendered here, making up the whole file: Let matplotlib write the file directly
+        if commit and (len(figures) == 1 or max_workers == 1) and self._is_new_file(page_nrs):
+            self._write_file(max_tries=5, write_stream=lambda stream: _write_figures(
+                stream=stream, figures=figures, bboxes=bboxes, facecolor=facecolor))
+
+            # Pages are loaded from file when next needed
+            self._backend.reset()
+            self._preload_path = self._file_path
+            return list(range(len(figures)))
+
+        # Convert figures to PDFs
+        if len(figures) > 1 and max_workers != 1:
+            pickled_figures = [pickle.dumps(figure, protocol=pickle.HIGHEST_PROTOCOL) for figure in figures]
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                pdfs = list(executor.map(_pickled_figure2pdf, pickled_figures, bboxes, repeat(facecolor)))
+        else:
+            pdfs = [self._figure2pdf(figure=figure, bbox_inches=bbox, facecolor=facecolor)
+                    for figure, bbox in zip(figures, bboxes)]
+
+        # Add pages
+        page_nrs = [self.add_page(page=self._backend.page_from_pdf(pdf_bytes), page_nr=page_nr, commit=False)
+                    for pdf_bytes, page_nr in zip(pdfs, page_nrs)]
+
+        # Commit if needed
+        if commit:
+            self.commit()
+
+        # Return page-nrs for optional book-keeping
+        return page_nrs
+
+    def _is_new_file(self, page_nrs):
+        """
+        Check if pages with the given page-numbers would make up the whole file, without any stamps.
+        :param list[int | None] page_nrs: Page number of each page (None for appended pages).
+        :return: bool
+        """
+        if not page_nrs or self._time_stamp_pages or self._enumerate_pages or self._spool_storage:
+            return False
+        if any(page_nr is not None and page_nr != nr for nr, page_nr in enumerate(page_nrs)):
+            return False
+        return self._file_length() == 0
+
+    def add_page(self, page, page_nr=None, commit=None):
         """
         Add a page to PDF.
-        :param PageObject page: Page
+        :param PageObject | pikepdf.Page page: Page. PyPDF2-pages are converted when using the pikepdf-backend.
         :param int page_nr: Page number of page.
             None: Append page to file.
             int:  Replace specific page location with page.
-        :param bool commit: Commit page to PDF. If False then page is held in buffer until commit() is called.
+        :param bool | None commit: Commit page to PDF. If False then page is held in buffer until commit() is called.
+            None: Use the setting of the container (auto_commit, or buffering within a with-block).
         """
+        # Convert page to backend
+        page = self._backend.convert_page(page)
+
+        # Size of page (read once for all stamps)
+        page_size = None
+        if self._time_stamp_pages or self._enumerate_pages:
+            page_size = pdf_page_size(page)
+
         # Check for time-stamping
         if self._time_stamp_pages:
-            self._time_stamper.do_stamp(page=page)
+            self._time_stamper.do_stamp(page=page, page_size=page_size)
 
         # Ensure page number
         if page_nr is None:
@@ -249,26 +455,39 @@ class PDFFigureContainer:
 
         # Check for page-enumeration
         if self._enumerate_pages:
-            self._enumerator.do_stamp(page=page, page_nr=page_nr)
+            self._enumerator.do_stamp(page=page, page_nr=page_nr, page_size=page_size)
 
-        # Add to spool
-        self._spool_storage.append((page_nr, page))
+        if commit is None:
+            commit = self._auto_commit
 
-        # Commit if needed
-        if commit:
-            self.commit()
+        # Committed page appended to file with nothing else in spool: Add directly to writer
+        if commit and not self._spool_storage and page_nr == self._file_length():
+            self._backend.append_pages([page])
+            self._backend.release_pages()
+            self._write_file(max_tries=5)
+
+        else:
+            # Add to spool
+            self._spool_storage.append((page_nr, page))
+
+            # Commit if needed
+            if commit:
+                self.commit()
 
         # Return page-nr for optional book-keeping
         return page_nr
 
     def _spool(self):
+        if self._preload_path is not None:
+            self._load_file()
+
         # Single element in spool storage
         if len(self._spool_storage) == 1:
             page_nr, page = self._spool_storage[0]
 
             # Check for single page appended and append fast
             if page_nr == self._file_length():
-                self._writer.addPage(page)
+                self._backend.append_pages([page])
 
             # Otherwise insert specifically
             else:
@@ -280,60 +499,74 @@ class PDFFigureContainer:
             page_nrs = [page_nr for page_nr, _ in self._spool_storage]
             pages = [page for _, page in self._spool_storage]
 
-            # All are appended
-            temp = list(range(self._file_length(), self._full_length()))
+            # All are appended (possibly out of order)
+            temp = range(self._file_length(), self._full_length())
             assert len(temp) == len(page_nrs)
-            if page_nrs == temp:
+            if set(page_nrs) == set(temp):
 
-                # Simply write to writer
-                for _, page in self._spool_storage:
-                    self._writer.addPage(page)
+                # Simply write to writer in order
+                self._backend.append_pages([page for _, page in sorted(self._spool_storage, key=lambda item: item[0])])
 
             # Otherwise insert specifically
             else:
                 self._write_pages(pages, page_nrs)
 
-        # Clear spool
+        # Clear spool (pages are now copied into the writer)
         self._spool_storage = []
+        self._backend.release_pages()
 
     def _write_pages(self, pages, page_nrs):
         """
         Inserts a number of pages to file.
-        :param list[PageObject] pages: Pages for file.
+        Existing pages are replaced in the writer, so other pages are not copied.
+        :param list[PageObject | pikepdf.Page] pages: Pages for file.
         :param list[int] page_nrs: Page-numbers of pages.
         """
         # Make dictionary mapping page-numbers to pages
         pages = {num: page for num, page in zip(page_nrs, pages)}
 
-        # Write past-data from writer to reader
-        reader = BytesIO()
-        self._writer.write(reader)
-        reader = PdfFileReader(reader)
+        # Pages past the end of the file must follow directly after it
+        n_kids = self._file_length()
+        appended = sorted(num for num in pages if num >= n_kids)
+        if appended and appended[-1] != n_kids + len(appended) - 1:
+            raise IndexError(f"Page-number {appended[-1]} is past the end of the file ({n_kids} pages).")
 
-        # Pages to scroll through
-        n_pages = max(max(page_nrs) + 1, reader.getNumPages())
+        # Replace existing pages
+        self._backend.replace_pages({num: page for num, page in pages.items() if num < n_kids})
 
-        # Make new writer and transfer pages
-        self._writer = PdfFileWriter()
-        for i in range(n_pages):
-            # Replace page
-            if i in pages:
-                self._writer.addPage(pages[i])
-            else:
-                self._writer.addPage(reader.getPage(i))
+        # Append remaining pages
+        self._backend.append_pages([pages[num] for num in appended])
 
-    def _write_file(self, max_tries):
-        # Save to file - if exceptions are found, then make 5 attempts with a small time-delay
+    def _write_file(self, max_tries, write_stream=None):
+        """
+        Write PDF-file, by writing a temporary file next to it and replacing the PDF-file with it.
+        :param int max_tries: Number of attempts at replacing the PDF-file.
+        :param write_stream: Function writing PDF to a stream. Defaults to writing the pages of the writer.
+        """
+        if write_stream is None:
+            write_stream = self._backend.write
+
+        # Write to temporary file next to the PDF-file, so the PDF-file is never left half-written
+        temp_path = self._file_path.with_name(self._file_path.name + ".tmp")
+        try:
+            # Large buffer, as the writer makes many small writes (one or more per PDF-object)
+            with temp_path.open("wb", buffering=1 << 20) as output_stream:
+                write_stream(output_stream)
+                output_stream.flush()
+                os.fsync(output_stream.fileno())
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+        # Replace PDF-file - if exceptions are found (ex. file held by a viewer on Windows),
+        # then make 5 attempts with a small time-delay
         try_nr = 0
         keep_trying = True
         while keep_trying:
 
-            # Try to save
+            # Try to replace
             try:
-
-                # Save
-                with self._file_path.open("wb") as output_stream:
-                    self._writer.write(output_stream)
+                os.replace(temp_path, self._file_path)
 
                 # We are done
                 keep_trying = False
@@ -341,8 +574,58 @@ class PDFFigureContainer:
             except PermissionError as e:
                 # Check if exception should be raised
                 if try_nr >= max_tries:
+                    temp_path.unlink(missing_ok=True)
                     raise e
 
                 # Sleep and update number of tries
                 sleep(0.25)
                 try_nr += 1
+
+
+
+def _get_figure(figure=None):
+    """
+    Get figure, defaulting to the current figure of pyplot.
+    pyplot is imported when needed, as it selects a backend on import.
+    :param figure: Figure or None.
+    :return: Figure
+    """
+    if figure is None:
+        import matplotlib.pyplot as plt
+        figure = plt.gcf()
+    return figure
+
+
+def _write_figures(stream, figures, bboxes, facecolor):
+    """
+    Save figures as pages of a single PDF, using matplotlib's PdfPages.
+    :param stream: Stream to write PDF to.
+    :param list figures: Figures to put into PDF.
+    :param list bboxes: Setting for making each page tight. Passed onto pyplot.savefig().
+    :param facecolor: Facecolor of pages.
+    """
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    options = dict()
+    if facecolor is not None:
+        options["facecolor"] = facecolor
+
+    with PdfPages(stream) as pdf_pages:
+        for figure, bbox in zip(figures, bboxes):
+            pdf_pages.savefig(figure, bbox_inches=bbox, **options)
+
+
+def _pickled_figure2pdf(pickled_figure, bbox_inches, facecolor):
+    """
+    Unpickle figure and save it as a single-page PDF (used for rendering figures in other processes).
+    :param bytes pickled_figure: Pickled matplotlib figure.
+    :param str bbox_inches: Setting for making page tight. Passed onto pyplot.savefig().
+    :param facecolor: Facecolor of page.
+    :return: bytes
+    """
+    import matplotlib.pyplot as plt
+
+    figure = pickle.loads(pickled_figure)
+    pdf_bytes = PDFFigureContainer._figure2pdf(figure=figure, bbox_inches=bbox_inches, facecolor=facecolor)
+    plt.close(figure)
+    return pdf_bytes
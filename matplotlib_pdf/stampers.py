@@ -1,4 +1,4 @@
-from .utility import add_datetime_to_page, annotate_pdf_page
+from .utility import add_datetime_to_page, annotate_pdf_page, make_datetime_formatter
 from PyPDF2 import PageObject
 
 
@@ -32,6 +32,22 @@ class PDFStamper:
         self.v_offset = v_offset
         self.position = position
 
+        # Text-positions by page- and text-size, valid for the options in _geometry_options
+        self._geometry_cache = dict()
+        self._geometry_options = None
+
+    def _position_cache(self):
+        """
+        Returns cache of text-positions for the current options of the stamper.
+        The cache is cleared if any options have been changed since it was last used.
+        :return: dict
+        """
+        options = tuple(self._options_dict().items())
+        if options != self._geometry_options:
+            self._geometry_cache = dict()
+            self._geometry_options = options
+        return self._geometry_cache
+
     def _options_dict(self):
         """
         Returns options stored in stamper.
@@ -46,10 +62,11 @@ class PDFStamper:
             line_h_factor=self.line_h_factor
         )
 
-    def do_stamp(self, page, **kwargs):
+    def do_stamp(self, page, page_size=None, **kwargs):
         """
         Method for putting stamp on page.
         :param PageObject page: Page for stamp.
+        :param tuple[int, int] page_size: Width and height of page, if already known.
         :param kwargs:
         """
         raise NotImplementedError
@@ -88,22 +105,57 @@ class TimeStamper(PDFStamper):
         super().__init__(font_size=font_size, h_offset=h_offset, v_offset=v_offset, position=position,
                          char_w_factor=char_w_factor, line_h_factor=line_h_factor)
 
-        self.include_date = include_date
-        self.include_micro = include_micro
+        self._include_date = include_date
+        self._include_micro = include_micro
+        self._datetime_formatter = datetime_formatter
+        self._update_formatter()
         self.header = header
-        self.datetime_formatter = datetime_formatter
 
-    def do_stamp(self, page, **kwargs):
+    @property
+    def include_date(self):
+        return self._include_date
+
+    @include_date.setter
+    def include_date(self, value):
+        self._include_date = value
+        self._update_formatter()
+
+    @property
+    def include_micro(self):
+        return self._include_micro
+
+    @include_micro.setter
+    def include_micro(self, value):
+        self._include_micro = value
+        self._update_formatter()
+
+    @property
+    def datetime_formatter(self):
+        return self._datetime_formatter
+
+    @datetime_formatter.setter
+    def datetime_formatter(self, value):
+        self._datetime_formatter = value
+        self._update_formatter()
+
+    def _update_formatter(self):
+        # Formatter used for all pages
+        self._formatter = make_datetime_formatter(include_date=self._include_date,
+                                                  include_micro=self._include_micro,
+                                                  datetime_formatter=self._datetime_formatter)
+
+    def do_stamp(self, page, page_size=None, **kwargs):
         """
         Put stamp on page.
         :param PageObject page: Page for stamp.
+        :param tuple[int, int] page_size: Width and height of page, if already known.
         :param kwargs:
         """
         add_datetime_to_page(pdf_page=page,
                              header=self.header,
-                             include_date=self.include_date,
-                             include_micro=self.include_micro,
-                             datetime_formatter=self.datetime_formatter,
+                             datetime_formatter=self._formatter,
+                             position_cache=self._position_cache(),
+                             page_size=page_size,
                              **self._options_dict()
                              )
 
@@ -138,28 +190,54 @@ class Enumerator(PDFStamper):
         super().__init__(font_size=font_size, h_offset=h_offset, v_offset=v_offset, position=position,
                          char_w_factor=char_w_factor, line_h_factor=line_h_factor)
 
-        self.header = header
-        self.n_pages = n_pages
+        self._header = header
+        self._n_pages = n_pages
+        self._update_text_parts()
         self.nr = 0
 
+    @property
+    def header(self):
+        return self._header
+
+    @header.setter
+    def header(self, value):
+        self._header = value
+        self._update_text_parts()
+
+    @property
+    def n_pages(self):
+        return self._n_pages
+
+    @n_pages.setter
+    def n_pages(self, value):
+        self._n_pages = value
+        self._update_text_parts()
+
+    def _update_text_parts(self):
+        # Parts of the text which are the same on all pages
+        self._header_prefix = "" if self._header is None else (self._header + "\n")
+        self._n_pages_suffix = "" if self._n_pages is None else f" / {self._n_pages}"
+
     def reset(self, value=0):
         self.nr = value
 
-    def do_stamp(self, page, page_nr=None, **kwargs):
+    def do_stamp(self, page, page_nr=None, page_size=None, **kwargs):
         """
         Put stamp on page.
         :param PageObject page: Page for stamp.
         :param int | None page_nr: Page number.
+        :param tuple[int, int] page_size: Width and height of page, if already known.
         :param kwargs:
         """
         if page_nr is None:
             page_nr = self.nr
             self.nr += 1
 
-        text = "" if self.header is None else (self.header + "\n")
-        text += f"{page_nr+1}" if self.n_pages is None else f"{page_nr+1} / {self.n_pages}"
+        text = f"{self._header_prefix}{page_nr+1}{self._n_pages_suffix}"
 
         annotate_pdf_page(pdf_page=page,
                           text=text,
+                          position_cache=self._position_cache(),
+                          page_size=page_size,
                           **self._options_dict()
                           )
@@ -1,20 +1,21 @@
 from datetime import datetime
-from io import BytesIO
+from functools import lru_cache, partial
 
-from PyPDF2 import PdfFileReader, PageObject
-from reportlab.pdfgen.canvas import Canvas
+from PyPDF2 import PageObject
 
 from pathlib import Path
 
+from ._pdf_backend import page_backend
+
 package_dir = Path(__file__).parent
 
 
 def annotate_pdf_page(pdf_page, text, font_size=12,
                       h_offset=2, v_offset=2, position="nw",
-                      char_w_factor=0.5, line_h_factor=1.35):
+                      char_w_factor=0.5, line_h_factor=1.35, position_cache=None, page_size=None):
     """
     Put annotation on PDF-page and return the new page.
-    :param PageObject pdf_page: Page for annotation.
+    :param PageObject | pikepdf.Page pdf_page: Page for annotation.
     :param str text: String to write on page.
     :param int font_size: Self-explanatory.
     :param int h_offset: Offset in the horizontal direction from page edge.
@@ -34,17 +35,145 @@ def annotate_pdf_page(pdf_page, text, font_size=12,
         Used for aligning text horizontally.
     :param float line_h_factor: Factor for approximating line-height from font-size.
         Used for aligning text vertically.
-    :return: PageObject
+    :param dict position_cache: Optional cache of text-positions, keyed by (width, height, n_lines, str_width).
+        Must only be shared between calls with the same font-size, offsets, position and factors.
+    :param tuple[int, int] page_size: Width and height of page, if already known (see pdf_page_size()).
+    :return: PageObject | pikepdf.Page
     """
+    backend = page_backend(pdf_page)
+
     # PDF size
-    page_size = pdf_page.mediaBox
-    height = int(page_size[3])
-    width = int(page_size[2])
+    if page_size is None:
+        page_size = backend.page_size(pdf_page)
+    width, height = page_size
 
     # Number of lines and width of string
-    n_lines = text.count("\n") + 1
-    str_width = max([len(val) for val in text.split("\n")])
+    lines, str_width = _measure_text(text)
+    n_lines = len(lines)
+
+    # Position of text
+    geometry = (width, height, n_lines, str_width)
+    if position_cache is not None and geometry in position_cache:
+        x, y = position_cache[geometry]
+    else:
+        x, y = stamp_position(width=width, height=height, n_lines=n_lines, str_width=str_width,
+                              font_size=font_size, h_offset=h_offset, v_offset=v_offset, position=position,
+                              char_w_factor=char_w_factor, line_h_factor=line_h_factor)
+        if position_cache is not None:
+            position_cache[geometry] = x, y
+
+    # Add text to the content of the page
+    backend.add_text(pdf_page=pdf_page,
+                     make_content=partial(_stamp_content_stream, x=x, y=y, font_size=font_size, lines=lines))
+
+    return pdf_page
+
+
+def _measure_text(text):
+    """
+    Split text into lines and find the number of characters in the longest line.
+    Stamps usually only change in their last line (ex. page-number below a header), so the lines before it are
+    measured once, while the last line is measured for each text.
+    :param str text: Text.
+    :return: tuple[tuple[str], int]
+    """
+    head, separator, last = text.rpartition("\n")
+    if not separator:
+        return (last,), len(last)
+
+    head_lines, head_width = _measure_lines(head)
+    return head_lines + (last,), max(head_width, len(last))
+
+
+@lru_cache(maxsize=256)
+def _measure_lines(text):
+    """
+    Split text into lines and find the number of characters in the longest line.
+    :param str text: Text.
+    :return: tuple[tuple[str], int]
+    """
+    lines = tuple(text.split("\n"))
+    return lines, max(map(len, lines))
+
+
+def pdf_page_size(pdf_page):
+    """
+    Width and height of a page (from its media-box).
+    :param PageObject | pikepdf.Page pdf_page: Page.
+    :return: tuple[int, int]
+    """
+    return page_backend(pdf_page).page_size(pdf_page)
+
+
+@lru_cache(maxsize=256)
+def _stamp_content_stream(x, y, font_size, lines, font_name):
+    """
+    Make the content of a stamp, as PDF text-operators.
+    Lines are separated by a leading of 1.2 times the font-size.
+    Results are cached, so identical stamps are only made once.
+    :param int x: Horizontal position of text.
+    :param int y: Vertical position of text.
+    :param int font_size: Self-explanatory.
+    :param tuple[str] lines: Lines of text to put on page.
+    :param str font_name: Name of font in the resources of the page.
+    :return: bytes
+    """
+    text = b" Tj T* ".join(_pdf_string(line) for line in lines)
+    return (f"q BT {font_name} {font_size:g} Tf {1.2 * font_size:g} TL {x} {y} Td ".encode()
+            + text + b" Tj ET Q\n")
+
+
+# Characters which must be escaped in PDF literal strings
+_PDF_STRING_SPECIAL = frozenset("\\()\r")
+
 
+@lru_cache(maxsize=256)
+def _pdf_string(text):
+    """
+    Make PDF literal string from text (characters not in the font-encoding are replaced by "?").
+    Results are cached, so lines repeated on many pages (ex. headers) are only escaped once.
+    :param str text: Text.
+    :return: bytes
+    """
+    # Most stamps are digits and separators, which need no escaping
+    if text.isascii() and not _PDF_STRING_SPECIAL.intersection(text):
+        return b"(" + text.encode("ascii") + b")"
+
+    data = text.encode("cp1252", errors="replace")
+    data = data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").replace(b"\r", b"\\r")
+    return b"(" + data + b")"
+
+
+# Horizontal (left, middle, right) and vertical (up, center, down) alignment of each position on page
+_POSITION_INDICES = dict(
+    n=(1, 0),
+    nw=(0, 0),
+    w=(0, 1),
+    sw=(0, 2),
+    s=(1, 2),
+    se=(2, 2),
+    e=(2, 1),
+    ne=(2, 0),
+)
+
+
+def stamp_position(width, height, n_lines, str_width, font_size=12,
+                   h_offset=2, v_offset=2, position="nw",
+                   char_w_factor=0.5, line_h_factor=1.35):
+    """
+    Compute coordinates of text on a page.
+    :param int width: Width of page.
+    :param int height: Height of page.
+    :param int n_lines: Number of lines in text.
+    :param int str_width: Number of characters in the longest line of text.
+    :param int font_size: Self-explanatory.
+    :param int h_offset: Offset in the horizontal direction from page edge.
+    :param int v_offset: Offset in the vertical direction from page edge.
+    :param str position: Position of text on page (see annotate_pdf_page()).
+    :param float char_w_factor: Factor for approximating character-width from font-size.
+    :param float line_h_factor: Factor for approximating line-height from font-size.
+    :return: tuple[int, int]
+    """
     # Font-size width- and height-factor
     char_width = font_size * char_w_factor
     line_height = line_h_factor * font_size
@@ -57,49 +186,63 @@ def annotate_pdf_page(pdf_page, text, font_size=12,
     center = height/2 - font_size + v_offset + (n_lines - 1) * line_height
     down = v_offset + (n_lines - 1) * line_height
 
-    # Compute position coordinates
-    position = position.lower()
-    x, y = dict(
-        n=(middle, up),
-        nw=(left, up),
-        w=(left, center),
-        sw=(left, down),
-        s=(middle, down),
-        se=(right, down),
-        e=(right, center),
-        ne=(right, up),
-    ).get(position, (h_offset, height - font_size + v_offset))
-    x = int(x)
-    y = int(y)
-
-    # Create PDF for text
-    packet = BytesIO()
-    canvas = Canvas(packet, pagesize=page_size)
-    canvas.setFontSize(font_size)
-
-    # Add text
-    draw_string(
-        canvas=canvas,
-        x=x,
-        y=y,
-        text=text)
-    canvas.save()
-
-    # Move to beginning of BytesIO and throw packet into reader
-    packet.seek(0)
-    new_pdf = PdfFileReader(packet)
-
-    # Add text by merging pages
-    pdf_page.mergePage(new_pdf.getPage(0))
+    # Compute position coordinates (unknown positions are put in the north-west corner)
+    h_index, v_index = _POSITION_INDICES.get(position.lower(), _POSITION_INDICES["nw"])
+    x = int((left, middle, right)[h_index])
+    y = int((up, center, down)[v_index])
 
-    return pdf_page
+    return x, y
+
+
+def make_datetime_formatter(include_date=False, include_micro=False, datetime_formatter=None):
+    """
+    Datetime formatter for time-stamps.
+    :param bool include_date: Include date in time-stamp.
+    :param bool include_micro: Include microseconds in time-stamp.
+    :param str datetime_formatter: Datetime formatter to use instead (overrides include_date and include_micro).
+    :return: str
+    """
+    if datetime_formatter is not None:
+        return datetime_formatter
+
+    formatter = "%H:%M:%S"
+    if include_date:
+        formatter = "%d/%m/%Y  " + formatter
+    if include_micro:
+        formatter += ":%f"
+    return formatter
+
+
+# Last time-stamp made, by (second, formatter)
+_timestamp_cache = dict()
+
+
+def _timestamp_text(formatter):
+    """
+    Current time formatted as a string.
+    Stamping many pages usually happens within the same second, so the last string is reused while the second (and
+    formatter) is the same. Formatters with microseconds are always formatted.
+    :param str formatter: Datetime formatter as specified by the datetime-package from Python.
+    :return: str
+    """
+    now = datetime.now()
+    if "%f" in formatter:
+        return now.strftime(formatter)
+
+    key = (now.replace(microsecond=0), formatter)
+    text = _timestamp_cache.get(key)
+    if text is None:
+        text = now.strftime(formatter)
+        _timestamp_cache.clear()
+        _timestamp_cache[key] = text
+    return text
 
 
 def add_datetime_to_page(pdf_page, font_size=12,
                          h_offset=1, v_offset=0, header=None,
                          include_date=False, include_micro=False,
                          datetime_formatter=None, position="nw",
-                         char_w_factor=0.5, line_h_factor=1.35):
+                         char_w_factor=0.5, line_h_factor=1.35, position_cache=None, page_size=None):
     """
     Put datetime-stamp on page and return the new page.
     :param PageObject pdf_page: Page for annotation.
@@ -125,19 +268,16 @@ def add_datetime_to_page(pdf_page, font_size=12,
         Used for aligning text horizontally.
     :param float line_h_factor: Factor for approximating line-height from font-size.
         Used for aligning text vertically.
+    :param dict position_cache: Optional cache of text-positions (see annotate_pdf_page()).
+    :param tuple[int, int] page_size: Width and height of page, if already known (see pdf_page_size()).
     :return: PageObject
     """
     # Formatting of time-stamp
-    formatter = "%H:%M:%S"
-    if include_date:
-        formatter = "%d/%m/%Y  " + formatter
-    if include_micro:
-        formatter += ":%f"
-    if datetime_formatter is not None:
-        formatter = datetime_formatter
+    formatter = make_datetime_formatter(include_date=include_date, include_micro=include_micro,
+                                        datetime_formatter=datetime_formatter)
 
     # Get time-stamp
-    text = datetime.now().strftime(formatter)
+    text = _timestamp_text(formatter)
 
     # Add header
     if header is not None:
@@ -151,37 +291,8 @@ def add_datetime_to_page(pdf_page, font_size=12,
                                  v_offset=v_offset,
                                  position=position,
                                  char_w_factor=char_w_factor,
-                                 line_h_factor=line_h_factor)
+                                 line_h_factor=line_h_factor,
+                                 position_cache=position_cache,
+                                 page_size=page_size)
 
     return pdf_page
-
-
-def draw_string(canvas, x, y, text, mode=None, char_space=0):
-    """
-    Draws a string onto a reportlab Canvas.
-    :param Canvas canvas: Canvas used for drawing string onto PDF.
-    :param int x: Horizontal position.
-    :param int y: Vertical position.
-    :param str text: String to put on page.
-    :param str mode: Mode passed to Canvas.setTextRenderMode()
-    :param int char_space: Parameter passed to Canvas.setCharSpace()
-    """
-    t = canvas.beginText(x, y)
-    if mode is not None:
-        t.setTextRenderMode(mode)
-    if char_space:
-        t.setCharSpace(char_space)
-
-    # Ensure line-breaks
-    if isinstance(text, str):
-        text = text.split("\n")
-        t.textLines(text)
-    else:
-        t.textLines(text)
-
-    if char_space:
-        t.setCharSpace(0)
-    if mode is not None:
-        t.setTextRenderMode(0)
-
-    canvas.drawText(t)
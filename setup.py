@@ -17,7 +17,8 @@ setup(
     packages=["matplotlib_pdf"],
 
     # Requirements
-    install_requires=["matplotlib", "PyPDF2", "reportlab"],
+    install_requires=["matplotlib", "PyPDF2"],
+    extras_require={"pikepdf": ["pikepdf"]},
 
     # Display on PyPI
     author='Jeppe Nørregaard',
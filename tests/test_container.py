@@ -0,0 +1,251 @@
+import subprocess
+import sys
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+from PyPDF2 import PdfFileReader
+
+from matplotlib_pdf import PDFFigureContainer
+
+
+def _make_figure(the_title, n_points=1, layout=None):
+    figure = plt.figure(layout=layout)
+    ax = figure.gca()  # type: plt.Axes
+    ax.scatter(np.linspace(0, 1, n_points), np.linspace(0, 1, n_points))
+    ax.set_title(the_title)
+    return figure
+
+
+def test_replaced_pages_not_kept_in_file(tmp_path):
+    pdf = PDFFigureContainer(file_path=tmp_path / "test_file.pdf")
+    for nr in range(2):
+        pdf.add_figure_page(figure=_make_figure(f"Axes {nr}"))
+        plt.close("all")
+
+    # Replace the same page repeatedly with figures of the same size
+    sizes = []
+    for nr in range(5):
+        pdf.add_figure_page(page_nr=1, figure=_make_figure(f"Axes 1 replaced {nr}", n_points=2000))
+        plt.close("all")
+        sizes.append(pdf.file_path.stat().st_size)
+
+    assert len(pdf) == 2
+    assert max(sizes) < 1.1 * min(sizes)
+
+
+def _page_sizes(file_path):
+    return [tuple(float(value) for value in page.mediaBox[2:]) for page in PdfFileReader(str(file_path)).pages]
+
+
+def test_cached_tight_bbox(tmp_path):
+    page_sizes = []
+    for cache_tight_bbox in (False, True):
+        pdf = PDFFigureContainer(file_path=tmp_path / f"cache_{cache_tight_bbox}.pdf",
+                                 cache_tight_bbox=cache_tight_bbox)
+        for nr in range(2):
+            figure = _make_figure(f"Axes {nr}", layout="constrained")
+            figure.gca().set_xlabel("x-label")
+            pdf.add_figure_page(figure=figure)
+            plt.close("all")
+        page_sizes.append(_page_sizes(pdf.file_path))
+
+    # First page is saved with the tight bounding-box of matplotlib, and following pages reuse it
+    assert page_sizes[1][0] == page_sizes[0][0]
+    assert page_sizes[1][1] == page_sizes[1][0]
+
+
+def test_add_figure_pages_checks_page_nrs(tmp_path):
+    pdf = PDFFigureContainer(file_path=tmp_path / "test_file.pdf")
+    figures = [_make_figure(f"Axes {nr}") for nr in range(3)]
+    with pytest.raises(ValueError):
+        pdf.add_figure_pages(figures, page_nrs=[None], max_workers=1)
+    plt.close("all")
+    assert len(pdf) == 0
+
+
+def test_write_error_not_hidden(tmp_path):
+    pdf = PDFFigureContainer(file_path=tmp_path / "missing" / "test_file.pdf", mk_dir=False)
+    with pytest.raises(FileNotFoundError) as exc_info:
+        pdf.add_figure_page(figure=_make_figure("Axes"))
+    plt.close("all")
+
+    # Error from opening the temporary file (not from cleaning it up while handling that error)
+    assert exc_info.value.__context__ is None
+
+
+def _page_texts(file_path):
+    return [page.extractText() for page in PdfFileReader(str(file_path)).pages]
+
+
+def test_pikepdf_backend(tmp_path):
+    pytest.importorskip("pikepdf")
+    file_path = tmp_path / "test_file.pdf"
+
+    pdf = PDFFigureContainer(file_path=file_path, backend="pikepdf")
+    for nr in range(2):
+        pdf.add_figure_page(figure=_make_figure(f"Axes {nr}"))
+
+    # PyPDF2-page buffered until commit
+    pdf.add_page(PDFFigureContainer.figure2page(figure=_make_figure("Axes 2")), commit=False)
+    assert len(pdf) == 3
+    pdf.commit()
+
+    # Replace page with stamps
+    pdf.set_enumeration(font_size=9, header="Page (nr)")
+    pdf.add_figure_page(page_nr=1, figure=_make_figure("Axes 1 replaced"))
+    plt.close("all")
+    assert len(pdf) == 3
+    del pdf
+
+    # Reload and append
+    pdf = PDFFigureContainer(file_path=file_path, truncate_file=False, backend="pikepdf")
+    pdf.set_enumeration(font_size=9)
+    pdf.add_figure_page(figure=_make_figure("Axes 3"))
+    plt.close("all")
+    assert len(pdf) == 4
+
+    texts = _page_texts(file_path)
+    assert len(texts) == 4
+    assert ["Axes 1 replaced" in text for text in texts] == [False, True, False, False]
+    assert "Page (nr)\n2" in texts[1]
+    assert texts[3].endswith("4")
+    assert "Page" not in texts[0] + texts[2] + texts[3]
+
+
+def test_pikepdf_imported_when_needed(tmp_path):
+    pytest.importorskip("pikepdf")
+    code = (
+        "import sys\n"
+        "from matplotlib_pdf import PDFFigureContainer\n"
+        f"PDFFigureContainer(file_path={str(tmp_path / 'test_file.pdf')!r})\n"
+        "assert 'pikepdf' not in sys.modules\n"
+        f"PDFFigureContainer(file_path={str(tmp_path / 'test_file.pdf')!r}, backend='auto')\n"
+        "assert 'pikepdf' in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_cached_figures(tmp_path, monkeypatch):
+    saved = []
+    figure2pdf = PDFFigureContainer._figure2pdf
+
+    def _counted_figure2pdf(**kwargs):
+        saved.append(kwargs["figure"])
+        return figure2pdf(**kwargs)
+
+    monkeypatch.setattr(PDFFigureContainer, "_figure2pdf", staticmethod(_counted_figure2pdf))
+
+    pdf = PDFFigureContainer(file_path=tmp_path / "test_file.pdf", cache_figures=True)
+    figure = _make_figure("Axes")
+
+    # Same unchanged figure is only saved once
+    pdf.add_figure_page(figure=figure)
+    pdf.add_figure_page(figure=figure)
+    assert len(saved) == 1
+
+    # Changed figure is saved again
+    figure.gca().set_title("Axes changed")
+    pdf.add_figure_page(figure=figure)
+    assert len(saved) == 2
+
+    # Other options are saved again
+    pdf.add_figure_page(figure=figure, bbox_inches=None)
+    assert len(saved) == 3
+    pdf.add_figure_page(figure=figure, bbox_inches=None, facecolor="gray")
+    assert len(saved) == 4
+    pdf.add_figure_page(figure=figure, bbox_inches=None, facecolor="gray")
+    assert len(saved) == 4
+    plt.close("all")
+
+    texts = _page_texts(pdf.file_path)
+    assert len(texts) == 6
+    assert ["Axes changed" in text for text in texts] == [False, False, True, True, True, True]
+
+
+def test_spooled_appends_out_of_order(tmp_path):
+    pdf = PDFFigureContainer(file_path=tmp_path / "test_file.pdf")
+    pdf.add_figure_page(figure=_make_figure("Axes 0"))
+
+    # Spool appended pages in reverse order
+    n_pages = len(pdf)
+    pdf.add_page(PDFFigureContainer.figure2page(figure=_make_figure("Axes 2")), page_nr=n_pages + 1, commit=False)
+    pdf.add_page(PDFFigureContainer.figure2page(figure=_make_figure("Axes 1")), page_nr=n_pages, commit=False)
+    plt.close("all")
+    pdf.commit()
+
+    texts = _page_texts(pdf.file_path)
+    assert len(texts) == 3
+    assert [f"Axes {nr}" in text for nr, text in enumerate(texts)] == [True] * 3
+
+
+@pytest.fixture
+def written_figures(monkeypatch):
+    """
+    Figures written directly to file by matplotlib in add_figure_pages().
+    """
+    import matplotlib_pdf.pdf_figure_manager as pdf_figure_manager
+
+    written = []
+    write_figures = pdf_figure_manager._write_figures
+
+    def _counted_write_figures(**kwargs):
+        written.extend(kwargs["figures"])
+        return write_figures(**kwargs)
+
+    monkeypatch.setattr(pdf_figure_manager, "_write_figures", _counted_write_figures)
+    return written
+
+
+def test_add_figure_pages_new_file(tmp_path, written_figures):
+    pdf = PDFFigureContainer(file_path=tmp_path / "test_file.pdf")
+    page_nrs = pdf.add_figure_pages([_make_figure(f"Axes {nr}") for nr in range(3)], max_workers=1)
+    plt.close("all")
+    assert len(written_figures) == 3
+    assert page_nrs == [0, 1, 2]
+    assert len(pdf) == 3
+
+    texts = _page_texts(pdf.file_path)
+    assert [f"Axes {nr}" in text for nr, text in enumerate(texts)] == [True] * 3
+
+    # Pages are loaded from the file for replacing and stamping
+    pdf.add_figure_page(page_nr=0, figure=_make_figure("Axes 0 replaced"))
+    pdf.set_enumeration(font_size=9, header="Page")
+    pdf.add_figure_page(figure=_make_figure("Axes 3"))
+    plt.close("all")
+    assert len(pdf) == 4
+
+    texts = _page_texts(pdf.file_path)
+    assert len(texts) == 4
+    assert "Axes 0 replaced" in texts[0]
+    assert [f"Axes {nr}" in text for nr, text in enumerate(texts[1:], 1)] == [True] * 3
+    assert texts[3].endswith("Page\n4")
+
+
+def test_add_figure_pages_not_new_file(tmp_path, written_figures):
+    # Stamped pages
+    pdf = PDFFigureContainer(file_path=tmp_path / "stamped.pdf")
+    pdf.set_enumeration(font_size=9, header="Page")
+    pdf.add_figure_pages([_make_figure(f"Axes {nr}") for nr in range(2)], max_workers=1)
+    plt.close("all")
+    assert _page_texts(pdf.file_path)[1].endswith("Page\n2")
+
+    # Pages in spool
+    pdf = PDFFigureContainer(file_path=tmp_path / "spooled.pdf")
+    pdf.add_figure_page(figure=_make_figure("Axes 0"), commit=False)
+    pdf.add_figure_pages([_make_figure(f"Axes {nr}") for nr in range(1, 3)], max_workers=1)
+    plt.close("all")
+    assert len(_page_texts(pdf.file_path)) == 3
+
+    # Page-numbers not in order from the start of the file
+    pdf = PDFFigureContainer(file_path=tmp_path / "unordered.pdf")
+    pdf.add_figure_pages([_make_figure(f"Axes {nr}") for nr in (1, 0)], page_nrs=[1, 0], max_workers=1)
+    plt.close("all")
+    texts = _page_texts(pdf.file_path)
+    assert [f"Axes {nr}" in text for nr, text in enumerate(texts)] == [True] * 2
+
+    assert written_figures == []
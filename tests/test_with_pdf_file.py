@@ -19,6 +19,8 @@ def test_w_pdf():
     n_late_commit_figures = 3
     n_pages_create_separately = 3
     n_stamped_figures = 3
+    n_with_block_figures = 2
+    n_parallel_figures = 3
 
     nr_replace = 1
     nr_replaced_w_stamp = 7
@@ -123,6 +125,35 @@ def test_w_pdf():
     pdf.add_figure_page(page_nr=nr_replaced_w_stamp)
     plt.close()
 
+    assert len(pdf) == n_total
+
+    # Add multiple within with-block, committed at end of block
+    with pdf:
+        for nr in range(len(pdf) + 1, len(pdf) + 1 + n_with_block_figures):
+            title = f"Axes {nr}, made within with-block [check the stamps]"
+            correct_answers.append(title)
+            _make_figure(title)
+            pdf.add_figure_page()
+            plt.close()
+
+        # noinspection PyProtectedMember
+        assert pdf._writer.getNumPages() == n_total
+
+    n_total += n_with_block_figures
+    # noinspection PyProtectedMember
+    assert pdf._writer.getNumPages() == n_total
+
+    # Add multiple figures rendered in parallel
+    figures = []
+    for nr in range(len(pdf) + 1, len(pdf) + 1 + n_parallel_figures):
+        title = f"Axes {nr}, rendered in parallel [check the stamps]"
+        correct_answers.append(title)
+        _make_figure(title)
+        figures.append(plt.gcf())
+    pdf.add_figure_pages(figures)
+    plt.close("all")
+
+    n_total += n_parallel_figures
     assert len(pdf) == n_total
     del pdf
 